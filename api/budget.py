@@ -0,0 +1,72 @@
+import os
+import re
+import math
+
+
+# each weibo comment should be less than 140 characters, see `split_string_from_symbol`
+FRAGMENT_LEN = 140
+# tokenizer-free estimation for deepseek-chat: a CJK character is about 0.6 token, other characters about 0.3 token
+CJK_TOKEN_RATIO = 0.6
+OTHER_TOKEN_RATIO = 0.3
+# leave some room so that the last fragment is not cut in the middle of a sentence
+OUTPUT_TOKEN_MARGIN = 1.2
+# the upper bound of the tokens for each part of the user prompt
+INPUT_TOKEN_BUDGET = {
+    "text": 400,
+    "status_text": 600,
+    "vlm": 400,
+}
+# how many comments we are willing to post for each kind of reply, can be overridden by `MAX_FRAGMENTS_<TYPE>`
+MAX_FRAGMENTS = {
+    "status": 2,
+    "comment": 2,
+    "analysis": 3,
+}
+
+_cjk_pattern = re.compile(r'[\u2e80-\u9fff\uac00-\ud7af\uf900-\ufaff\uff00-\uffef]')
+_sentence_end = "。！？；，.!?;\n"
+
+
+def _char_tokens(c: str) -> float:
+    return CJK_TOKEN_RATIO if _cjk_pattern.match(c) else OTHER_TOKEN_RATIO
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estimate the token count of the text without loading the tokenizer
+    """
+    if not text:
+        return 0
+    cjk = len(_cjk_pattern.findall(text))
+    return math.ceil(cjk * CJK_TOKEN_RATIO + (len(text) - cjk) * OTHER_TOKEN_RATIO)
+
+
+def truncate_tokens(text: str, budget: int) -> str:
+    """
+    Truncate the text to the token budget, cut at the last sentence boundary if possible
+    """
+    if estimate_tokens(text) <= budget:
+        return text
+    total, end = 0., 0
+    for i, c in enumerate(text):
+        total += _char_tokens(c)
+        if total > budget:
+            end = i
+            break
+    head = text[:end]
+    cut = max(head.rfind(s) for s in _sentence_end)
+    # only use the sentence boundary if it does not drop too much content
+    if cut > end // 2:
+        head = head[:cut + 1]
+    return head + "……"
+
+
+def max_fragments(content_type: str) -> int:
+    return int(os.getenv(f"MAX_FRAGMENTS_{content_type.upper()}", MAX_FRAGMENTS[content_type]))
+
+
+def max_output_tokens(content_type: str) -> int:
+    """
+    The `max_tokens` of the LLM call, derived from the number of fragments we are willing to post
+    """
+    return math.ceil(max_fragments(content_type) * FRAGMENT_LEN * CJK_TOKEN_RATIO * OUTPUT_TOKEN_MARGIN)
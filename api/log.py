@@ -0,0 +1,156 @@
+import os
+import re
+import sys
+import json
+import uuid
+import queue
+import atexit
+import logging
+import hashlib
+import contextvars
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional
+
+
+# correlation id of the weibo event (or request) currently being handled, copied into every asyncio task
+event_id_var = contextvars.ContextVar("event_id", default=None)
+
+SENSITIVE_KEYS = ("access_token", "token", "secret", "sign", "api_key", "password", "authorization")
+_sensitive_pattern = re.compile(
+    r'''(?i)((?:access_token|token|secret|sign|api_key|password)['"]?\s*[:=]\s*(?:\(None,\s*)?['"]?)([^'"\s,&})]+)'''
+)
+_bearer_pattern = re.compile(r'(?i)(bearer\s+)(\S+)')
+# attributes every LogRecord has, anything else was passed with `extra` and is emitted as a structured field
+_reserved_attrs = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "sample"}
+
+_listener: Optional[QueueListener] = None
+
+
+def new_event_id() -> str:
+    """
+    Generate a new correlation id and bind it to the current context
+    """
+    event_id = uuid.uuid4().hex[:12]
+    event_id_var.set(event_id)
+    return event_id
+
+
+def _is_sensitive(key) -> bool:
+    if not isinstance(key, str):
+        return False
+    key = key.lower()
+    return key in SENSITIVE_KEYS or key.endswith(("_token", "_secret", "_key"))
+
+
+def redact(value):
+    """
+    Recursively mask the tokens and secrets in the log payload
+    """
+    if isinstance(value, dict):
+        return {k: ("***" if _is_sensitive(k) else redact(v)) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return type(value)(redact(v) for v in value)
+    if isinstance(value, str):
+        value = _sensitive_pattern.sub(r"\1***", value)
+        return _bearer_pattern.sub(r"\1***", value)
+    return value
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keep only a fraction of the high-volume info lines (logged with `extra={"sample": True}`).
+    The decision is made per correlation id, so the sampled events are kept completely.
+    Warnings and errors are never dropped.
+    """
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not getattr(record, "sample", False) or record.levelno > logging.INFO or self.rate >= 1:
+            return True
+        if self.rate <= 0:
+            return False
+        key = record.event_id or str(record.created)
+        bucket = int(hashlib.md5(key.encode()).hexdigest()[:8], 16) / 0xffffffff
+        return bucket < self.rate
+
+
+class _ContextQueueHandler(QueueHandler):
+    """
+    Attach the correlation id on the caller side and defer all the formatting to the writer thread
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # the default implementation formats the message here, i.e. on the event loop
+        return record
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.event_id = event_id_var.get()
+        return super().filter(record)
+
+
+class JSONFormatter(logging.Formatter):
+    """
+    Format the record as a single line json object with redacted message and fields
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        args = record.args
+        if args:
+            args = redact(args) if isinstance(args, dict) else tuple(redact(a) for a in args)
+        message = str(record.msg) % args if args else str(record.msg)
+        data = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "event_id": getattr(record, "event_id", None),
+            "msg": redact(message),
+        }
+        for k, v in record.__dict__.items():
+            if k not in _reserved_attrs and k != "event_id":
+                data[k] = "***" if _is_sensitive(k) else redact(v)
+        if record.exc_info:
+            data["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+def setup_logging(level: Optional[str] = None, sample_rate: Optional[float] = None) -> None:
+    """
+    Route the root logger through a queue, the records are formatted and written by a background thread.
+    Calling it more than once is a no-op.
+    """
+    global _listener
+    if _listener is not None:
+        return
+    level = level or os.getenv("LOG_LEVEL", "INFO")
+    if sample_rate is None:
+        sample_rate = float(os.getenv("LOG_SAMPLE_RATE", "0.2"))
+
+    log_queue = queue.SimpleQueue()
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(JSONFormatter())
+    queue_handler = _ContextQueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter(sample_rate))
+
+    root = logging.getLogger()
+    for h in list(root.handlers):
+        root.removeHandler(h)
+    root.addHandler(queue_handler)
+    root.setLevel(level.upper())
+
+    _listener = QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+
+def shutdown_logging() -> None:
+    """
+    Flush the pending records and stop the writer thread
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
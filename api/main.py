@@ -10,11 +10,14 @@ import logging
 import hashlib
 import requests
 import asyncio
-from api.llm import call_llm
+from api.llm import call_llm, basic_prompt
+from api.budget import INPUT_TOKEN_BUDGET, estimate_tokens, truncate_tokens, max_fragments, max_output_tokens
 from api.kv import KV
+from api.log import setup_logging, new_event_id
 
 
-logging.getLogger().setLevel(logging.INFO)
+setup_logging()
+logger = logging.getLogger(__name__)
 app = FastAPI()
 app.mount("/static", StaticFiles(directory="static"), name="static")
 all_tasks = asyncio.Queue()
@@ -63,9 +66,9 @@ class WeiboClient:
         """
         Check if the token is set and not expired, if so, return True and the token, otherwise return False and None
         """
-        logging.info("check token begin")
+        logger.debug("check token begin")
         access_token = kv.get("access_token")
-        logging.info(f"check token end {access_token}")
+        logger.debug("check token end %s", access_token)
         if access_token is None:
             return False, None
         else:
@@ -73,7 +76,7 @@ class WeiboClient:
             access_token = json.loads(access_token)
             # 60 is the update time for the token, the expire time of the token defined by weibo is 2 hour
             if (time.time() - access_token["created_at"]) >= 60:
-                logging.info(f"need to update token: {access_token}")
+                logger.info("need to update token, created_at: %s", access_token["created_at"])
                 return False, None
             else:
                 return True, access_token["token"]
@@ -82,7 +85,7 @@ class WeiboClient:
         """
         update token with the special weibo api for bot
         """
-        logging.info("begin to update token")
+        logger.info("begin to update token")
         app_key = os.getenv('APP_KEY')
         app_secret = os.getenv('APP_SECRET')
         uid = os.getenv('DEV_UID')
@@ -101,13 +104,13 @@ class WeiboClient:
         sign = '&'.join([data['client_id'], uid, data['timestamp'], data['nonce'], app_secret])
         md5_hash.update(sign.encode())
         data['sign'] = md5_hash.hexdigest()
-        logging.info(f'update_token: {data}, uid: {uid}')
+        logger.debug('update_token: %s, uid: %s', data, uid)
         url = 'https://api.weibo.com/oauth2/vp/authorize?client_id=' + data['client_id'] + '&timestamp=' + data['timestamp'] + '&nonce=' + data['nonce'] + '&sign=' + data['sign']
         response = requests.get(url)
         data = response.json()
         access_token = data.get("access_token")
         kv.set("access_token", {"token": access_token, "created_at": current_time_sec})
-        logging.info("update token success")
+        logger.info("update token success")
         return access_token
 
     def _get_access_token(self):
@@ -137,11 +140,11 @@ class WeiboClient:
 
         # retry `self.retry` times if the status code is not 200 (network error or expired token)
         for _ in range(self.retry):
-            logging.info(f"comment_reply: {data}")
+            logger.info("comment_reply: %s", data, extra={"sample": True})
             res = requests.post(url, data=data)
             if res.status_code != 200:
                 error_text = res.text
-                logging.info(f"text: {error_text} token: {access_token}")
+                logger.warning("weibo api error: %s", error_text)
                 error_data = json.loads(error_text)
                 # 21332 means the token is expired
                 if error_data["error_code"] == 21332:
@@ -167,11 +170,11 @@ class WeiboClient:
             data["pic_ids"] = pic_ids
         # retry `self.retry` times if the status code is not 200 (network error or expired token)
         for _ in range(self.retry):
-            logging.info(f"comment_create: {data}")
+            logger.info("comment_create: %s", data, extra={"sample": True})
             res = requests.post(url, data=data)
             if res.status_code != 200:
                 error_text = res.text
-                logging.info(f"text: {error_text} token: {access_token}")
+                logger.warning("weibo api error: %s", error_text)
                 error_data = json.loads(error_text)
                 # 21332 means the token is expired
                 if error_data["error_code"] == 21332:
@@ -188,11 +191,11 @@ class WeiboClient:
         }
         # retry `self.retry` times if the status code is not 200 (network error or expired token)
         for _ in range(self.retry):
-            logging.info(f"upload_image: {image_url}")
+            logger.info("upload_image: %s", image_url, extra={"sample": True})
             res = requests.post(url, files=files)
             if res.status_code != 200:
                 error_text = res.text
-                logging.info(f"text: {error_text} token: {access_token}")
+                logger.warning("weibo api error: %s", error_text)
                 error_data = json.loads(error_text)
                 # 21332 means the token is expired
                 if error_data["error_code"] == 21332:
@@ -295,6 +298,30 @@ def split_string_from_symbol(input_string):
     return formatted_string_list
 
 
+def reply_with_budget(prompt: str, reply_type: str, post_fn) -> None:
+    """
+    Call the LLM within the output budget of the reply type (status, comment, analysis) and post the reply fragments.
+    The latency and token counts are reported to tune the budgets in `api/budget.py`
+    """
+    begin = time.time()
+    fragments_budget = max_fragments(reply_type)
+    max_tokens = max_output_tokens(reply_type)
+    llm_text = call_llm(prompt, max_tokens=max_tokens)
+    llm_ms = round((time.time() - begin) * 1000, 1)
+    formatted_text = split_string_from_symbol(llm_text)
+    for t in formatted_text[:fragments_budget]:
+        post_fn(t)
+    logger.info("[budget]", extra={
+        "reply_type": reply_type,
+        "est_prompt_tokens": estimate_tokens(basic_prompt) + estimate_tokens(prompt),
+        "max_tokens": max_tokens,
+        "fragments": len(formatted_text),
+        "fragments_posted": min(len(formatted_text), fragments_budget),
+        "llm_ms": llm_ms,
+        "total_ms": round((time.time() - begin) * 1000, 1),
+    })
+
+
 def get_vlm_result(image_url: str, prompt: str) -> str:
     """
     Call the VLM model to generate the text description from the image
@@ -355,7 +382,7 @@ async def upload(image_url: str) -> str:
     }
     res = requests.post(url, files=files)
     if res.status_code != 200:
-        logging.info(f"text: {res.text} token: {files['access_token']}")
+        logger.warning("upload failed: %s", res.text)
         return ""
     else:
         return res.json().get("bmiddle_pic")
@@ -373,6 +400,9 @@ async def check(request: Request) -> bool:
     signature = form.get("signature")
     echostr = form.get("echostr")
 
+    # bind a correlation id to the log records of this event, including the background task
+    new_event_id()
+
     # response for the normal weibo data push
     if echostr is None:  # normal request
         rip = request.client.host
@@ -394,28 +424,27 @@ async def check(request: Request) -> bool:
 
             if text_at not in text:
                 if check_keyword(text, content_body):
-                    logging.info(f"user own post: {uid}, {screen_name}, {text}")
+                    logger.info("user own post", extra={"uid": uid, "screen_name": screen_name, "text": text})
                 else:
                     return JSONResponse({"result": True, "pull_later": False, "message": ""})
             if check_repeat_status(id_):
                 return JSONResponse({"result": True, "pull_later": False, "message": ""})
+            text = truncate_tokens(text, INPUT_TOKEN_BUDGET["text"])
             has_image = content_body.get("has_image")
             images = content_body.get("images", [])
             if has_image and len(images) > 0:
                 img_text = get_vlm_result(images[0], text[:140])
                 if img_text is not None:
+                    img_text = truncate_tokens(img_text, INPUT_TOKEN_BUDGET["vlm"])
                     text = text_img + img_text + text_img2 + text
-                    logging.info(f"[comment img]: {img_text}")
-                logging.info(f"[status] uid: {uid}, screen_name: {screen_name}, text: {text}, images: {images}")
+                    logger.info("[comment img]", extra={"img_text": img_text, "sample": True})
+                logger.info("[status]", extra={"uid": uid, "screen_name": screen_name, "text": text, "images": images, "sample": True})
             else:
-                logging.info(f"[status] uid: {uid}, screen_name: {screen_name}, text: {text}")
+                logger.info("[status]", extra={"uid": uid, "screen_name": screen_name, "text": text, "sample": True})
             text = emoji_filter(text)
 
             def _task():
-                llm_text = call_llm(text)
-                formatted_text = split_string_from_symbol(llm_text)
-                for t in formatted_text:
-                    weibo_client.comment_create(sid=id_, rip=rip, text=t)
+                reply_with_budget(text, "status", lambda t: weibo_client.comment_create(sid=id_, rip=rip, text=t))
 
             task = asyncio.create_task(async_task(_task))
             all_tasks.put_nowait(task)
@@ -428,37 +457,38 @@ async def check(request: Request) -> bool:
             if check_repeat_comment(id_, status_id):
                 return JSONResponse({"result": True, "pull_later": False, "message": ""})
 
-            text = emoji_filter(text)
+            text = truncate_tokens(emoji_filter(text), INPUT_TOKEN_BUDGET["text"])
             if text_analysis in text.lower():
+                reply_type = "analysis"
                 has_image = content_body.get("status").get("has_image")
                 images = content_body.get("status").get("images", [])
-                status_text = emoji_filter(status_text)
+                status_text = truncate_tokens(emoji_filter(status_text), INPUT_TOKEN_BUDGET["status_text"])
                 if has_image and len(images) > 0:
                     img_text = get_vlm_result(images[0], status_text[:140])
                     if img_text is not None:
+                        img_text = truncate_tokens(img_text, INPUT_TOKEN_BUDGET["vlm"])
                         text = text_img + img_text + text_img2 + text
-                        logging.info(f"[comment ana img]: {img_text}")
+                        logger.info("[comment ana img]", extra={"img_text": img_text, "sample": True})
                     else:
                         text = text_analysis_prefix + status_text
-                    logging.info(f"[comment ana] uid: {uid}, screen_name: {screen_name}, text: {text}, status_id: {status_id}, status_text: {status_text}, images: {images}")
+                    logger.info("[comment ana]", extra={"uid": uid, "screen_name": screen_name, "text": text, "status_id": status_id, "status_text": status_text, "images": images, "sample": True})
                 else:
                     text = text_analysis_prefix + status_text
-                    logging.info(f"[comment ana] uid: {uid}, screen_name: {screen_name}, text: {text}, status_id: {status_id}, status_text: {status_text}")
+                    logger.info("[comment ana]", extra={"uid": uid, "screen_name": screen_name, "text": text, "status_id": status_id, "status_text": status_text, "sample": True})
             else:
+                reply_type = "comment"
                 if has_image and len(images) > 0:
                     img_text = get_vlm_result(images[0], text[:140])
                     if img_text is not None:
+                        img_text = truncate_tokens(img_text, INPUT_TOKEN_BUDGET["vlm"])
                         text = text_img + img_text + text_img2 + text
-                        logging.info(f"[comment img]: {img_text}")
-                    logging.info(f"[comment] uid: {uid}, screen_name: {screen_name}, text: {text}, status_id: {status_id}, status_text: {status_text}, images: {images}")
+                        logger.info("[comment img]", extra={"img_text": img_text, "sample": True})
+                    logger.info("[comment]", extra={"uid": uid, "screen_name": screen_name, "text": text, "status_id": status_id, "status_text": status_text, "images": images, "sample": True})
                 else:
-                    logging.info(f"[comment] uid: {uid}, screen_name: {screen_name}, text: {text}, status_id: {status_id}, status_text: {status_text}")
+                    logger.info("[comment]", extra={"uid": uid, "screen_name": screen_name, "text": text, "status_id": status_id, "status_text": status_text, "sample": True})
 
             def _task():
-                llm_text = call_llm(text)
-                formatted_text = split_string_from_symbol(llm_text)
-                for t in formatted_text:
-                    weibo_client.comment_reply(cid=id_, sid=status_id, rip=rip, text=t)
+                reply_with_budget(text, reply_type, lambda t: weibo_client.comment_reply(cid=id_, sid=status_id, rip=rip, text=t))
 
             task = asyncio.create_task(async_task(_task))
             all_tasks.put_nowait(task)
@@ -467,23 +497,23 @@ async def check(request: Request) -> bool:
     # response for the weibo validation request
     else:
         nonce = form.get("nonce")
-        logging.info(f"nonce: {nonce}, timestamp: {timestamp}, echostr: {echostr}, signature: {signature}")
+        logger.info("nonce: %s, timestamp: %s, echostr: %s, signature: %s", nonce, timestamp, echostr, signature)
         cat_string = ''.join(sorted([timestamp, nonce, token]))
         if hashlib.sha1(cat_string.encode()).hexdigest() == signature:
-            logging.info(f"check success, echostr: {echostr}")
+            logger.info("check success, echostr: %s", echostr)
             return PlainTextResponse(content=echostr)
         else:
-            logging.error("check failed")
+            logger.error("check failed")
             return PlainTextResponse(content='', status_code=403)
 
 
 @app.on_event("shutdown")
 async def shutdown_event():
     while not all_tasks.empty():
-        logging.info(f"begin wait {time.ctime()}")
+        logger.info("begin wait %s", time.ctime())
         task = all_tasks.get_nowait()
         await task
-        logging.info(f"end wait {time.ctime()}")
+        logger.info("end wait %s", time.ctime())
 
 
 if __name__ == "__main__":
@@ -0,0 +1,22 @@
+from .budget import FRAGMENT_LEN, estimate_tokens, truncate_tokens, max_fragments, max_output_tokens
+
+
+def test_estimate_tokens():
+    assert estimate_tokens("") == 0
+    assert estimate_tokens("你好") == 2
+    assert estimate_tokens("abcdefghij") == 3
+
+
+def test_truncate_tokens():
+    text = "今天天气很好。" * 100
+    assert truncate_tokens("短文本", 100) == "短文本"
+    res = truncate_tokens(text, 60)
+    assert res.endswith("。……")
+    assert estimate_tokens(res[:-2]) <= 60
+
+
+def test_max_output_tokens(monkeypatch):
+    assert max_fragments("analysis") == 3
+    monkeypatch.setenv("MAX_FRAGMENTS_COMMENT", "1")
+    assert max_fragments("comment") == 1
+    assert FRAGMENT_LEN * 0.6 <= max_output_tokens("comment") < 4096
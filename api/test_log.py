@@ -0,0 +1,42 @@
+import json
+import logging
+
+from .log import JSONFormatter, SamplingFilter, event_id_var, new_event_id, redact
+
+
+def test_redact():
+    data = {"access_token": "abc", "cid": "1", "sign": "xyz", "comment": "hi"}
+    assert redact(data) == {"access_token": "***", "cid": "1", "sign": "***", "comment": "hi"}
+    text = str({"token": "2.00abc", "created_at": 1.0})
+    assert "2.00abc" not in redact(text)
+    assert redact("Bearer qwe123") == "Bearer ***"
+
+
+def test_json_formatter():
+    record = logging.LogRecord("api", logging.INFO, __file__, 1, "comment_create: %s", ({"access_token": "abc", "id": "2"},), None)
+    record.event_id = "e1"
+    record.uid = 3
+    data = json.loads(JSONFormatter().format(record))
+    assert data["event_id"] == "e1"
+    assert data["uid"] == 3
+    assert "abc" not in data["msg"]
+
+
+def test_sampling_filter():
+    def make(level, sample, event_id):
+        record = logging.LogRecord("api", level, __file__, 1, "msg", None, None)
+        record.sample = sample
+        record.event_id = event_id
+        return record
+
+    f = SamplingFilter(0.)
+    assert not f.filter(make(logging.INFO, True, "e1"))
+    assert f.filter(make(logging.INFO, False, "e1"))
+    assert f.filter(make(logging.WARNING, True, "e1"))
+    f = SamplingFilter(0.5)
+    assert all(f.filter(make(logging.INFO, True, "e1")) == f.filter(make(logging.INFO, True, "e1")) for _ in range(10))
+
+
+def test_event_id():
+    event_id = new_event_id()
+    assert event_id_var.get() == event_id